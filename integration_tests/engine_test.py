@@ -8,16 +8,32 @@
 # http://www.opensource.org/licenses/mit-license
 # Copyright (c) 2020-2022, Pablo S. Blum de Aguiar <scorphus@gmail.com>
 
+from load_tester import LoadTester
+from os import environ
 from os.path import join
 from thumbor_integration_tests import EngineCase
 from thumbor_integration_tests.urls_helpers import single_dataset
 from thumbor_integration_tests.urls_helpers import UrlsTester
+from tornado.httpclient import AsyncHTTPClient
 from tornado.testing import gen_test
+from unittest import skipUnless
+
+
+LOAD_TEST_REPORT = environ.get("LOAD_TEST_REPORT")
+LOAD_TEST_BASELINE = environ.get("LOAD_TEST_BASELINE")
+LOAD_TEST_CONCURRENCY = int(environ.get("LOAD_TEST_CONCURRENCY", 10))
+LOAD_TEST_THRESHOLD = float(environ.get("LOAD_TEST_THRESHOLD", 0.1))
 
 
 class EngineTest(EngineCase):
     engine = "thumbor_wand_engine"
 
+    def get_http_client(self):
+        # tornado's default of 10 clients would queue the load test's requests
+        return AsyncHTTPClient(
+            force_instance=True, max_clients=max(LOAD_TEST_CONCURRENCY, 10)
+        )
+
     @gen_test(timeout=60)
     async def test_single_params(self):
         if not self._app:
@@ -33,3 +49,21 @@ class EngineTest(EngineCase):
             await tester.try_url(self.get_url(f"/{url}"))
 
         tester.report()
+
+    @skipUnless(LOAD_TEST_REPORT, "set LOAD_TEST_REPORT to run the load test")
+    @gen_test(timeout=600)
+    async def test_single_params_load(self):
+        if not self._app:
+            return True
+        urls = [
+            self.get_url(f"/unsafe/{join(*options)}")
+            for options in single_dataset(with_gif=False)
+        ]
+        tester = LoadTester(self.http_client, LOAD_TEST_CONCURRENCY)
+
+        print(f"Requests count: {len(urls)}, concurrency: {LOAD_TEST_CONCURRENCY}")
+        await tester.run(urls)
+
+        tester.write_report(LOAD_TEST_REPORT)
+        if LOAD_TEST_BASELINE:
+            tester.compare(LOAD_TEST_BASELINE, LOAD_TEST_THRESHOLD)
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of thumbor-wand-engine
+# https://github.com/scorphus/thumbor-wand-engine
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2020-2022, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+from asyncio import gather
+from asyncio import Semaphore
+from math import ceil
+from resource import getrusage
+from resource import RUSAGE_SELF
+from time import perf_counter
+
+import json
+import logging
+import sys
+
+
+PERCENTILES = (50, 95, 99)
+METRICS = tuple(f"latency_p{pct}" for pct in PERCENTILES) + ("max_rss", "bytes")
+
+
+def percentile(values, pct):
+    """percentile uses the nearest-rank method, so it is always a sampled value"""
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[max(ceil(pct / 100 * len(values)), 1) - 1]
+
+
+def max_rss():
+    """max_rss is the resident set size high-water mark of this process (where
+    the thumbor app under test and its engine threadpool run) in bytes"""
+    rss = getrusage(RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def regressions(report, baseline, threshold):
+    """regressions lists the metrics that grew more than `threshold` over those
+    of `baseline`; metrics it lacks (or has as zero) cannot regress"""
+    return [
+        f"Regression in {metric}: {baseline[metric]} -> {report[metric]}"
+        for metric in METRICS
+        if baseline.get(metric) and report[metric] > baseline[metric] * (1 + threshold)
+    ]
+
+
+class LoadTester:
+    def __init__(self, http_client, concurrency=10):
+        max_clients = getattr(http_client, "max_clients", concurrency)
+        if max_clients < concurrency:
+            # requests would wait in the client queue and inflate latencies
+            raise ValueError(
+                f"http_client allows {max_clients} requests at once, not {concurrency}"
+            )
+        self.http_client = http_client
+        self.concurrency = concurrency
+        self.results = []
+
+    async def run(self, urls):
+        semaphore = Semaphore(self.concurrency)
+
+        async def try_url(url):
+            async with semaphore:
+                await self.try_url(url)
+
+        await gather(*(try_url(url) for url in urls))
+
+    async def try_url(self, url):
+        code, size = None, 0
+        start = perf_counter()
+        try:
+            response = await self.http_client.fetch(url, request_timeout=60)
+            code, size = response.code, len(response.body)
+        except Exception as err:  # pylint: disable=broad-except
+            logging.exception("Error in %s: %s", url, err)
+            code = getattr(err, "code", None)
+        latency = perf_counter() - start
+        self.results.append(
+            {"url": url, "code": code, "latency": latency, "bytes": size}
+        )
+
+    def report(self):
+        latencies = [result["latency"] for result in self.results]
+        report = {f"latency_p{pct}": percentile(latencies, pct) for pct in PERCENTILES}
+        report["max_rss"] = max_rss()
+        report["bytes"] = sum(result["bytes"] for result in self.results)
+        report["concurrency"] = self.concurrency
+        report["failed_urls"] = [
+            result["url"] for result in self.results if result["code"] != 200
+        ]
+        report["urls"] = sorted(self.results, key=lambda result: result["url"])
+        return report
+
+    def write_report(self, path):
+        with open(path, "w") as report_file:
+            json.dump(self.report(), report_file, indent=2)
+
+    def compare(self, baseline_path, threshold=0.1):
+        """compare raises an AssertionError listing the URLs that failed and the
+        metrics that grew more than `threshold` over those of a previous report"""
+        with open(baseline_path) as baseline_file:
+            baseline = json.load(baseline_file)
+        report = self.report()
+        errors = [f"Failed url: {url}" for url in report["failed_urls"]]
+        errors += regressions(report, baseline, threshold)
+        if errors:
+            raise AssertionError("\n".join(errors))
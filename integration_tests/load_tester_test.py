@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of thumbor-wand-engine
+# https://github.com/scorphus/thumbor-wand-engine
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2020-2022, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+from load_tester import LoadTester
+from load_tester import percentile
+from load_tester import regressions
+from unittest.mock import MagicMock
+
+import json
+import pytest
+
+
+REPORT = {
+    "latency_p50": 0.1,
+    "latency_p95": 0.2,
+    "latency_p99": 0.3,
+    "max_rss": 1000,
+    "bytes": 100,
+}
+
+
+@pytest.mark.parametrize(
+    "values, pct, expected",
+    [
+        ([], 50, 0),
+        ([7], 50, 7),
+        ([7], 99, 7),
+        ([4, 1, 3, 2], 50, 2),
+        ([4, 1, 3, 2], 95, 4),
+        (list(range(1, 101)), 95, 95),
+        (list(range(1, 101)), 99, 99),
+        (list(range(1, 11)), 99, 10),
+    ],
+)
+def test_percentile(values, pct, expected):
+    assert percentile(values, pct) == expected
+
+
+def test_regressions_none():
+    assert regressions(REPORT, REPORT, 0.1) == []
+
+
+@pytest.mark.parametrize(
+    "current, expected_regression", [(110, False), (111, True), (90, False)]
+)
+def test_regressions_threshold_edge(current, expected_regression):
+    report = dict(REPORT, bytes=current)
+    expected = [f"Regression in bytes: 100 -> {current}"]
+    assert regressions(report, REPORT, 0.1) == (expected if expected_regression else [])
+
+
+def test_regressions_zero_threshold():
+    report = dict(REPORT, max_rss=1001)
+    assert regressions(report, REPORT, 0) == ["Regression in max_rss: 1000 -> 1001"]
+
+
+def test_regressions_zero_baseline():
+    baseline = dict(REPORT, bytes=0)
+    assert regressions(REPORT, baseline, 0.1) == []
+
+
+def test_regressions_baseline_missing_metric():
+    baseline = {k: v for k, v in REPORT.items() if k != "latency_p99"}
+    report = dict(REPORT, latency_p99=10)
+    assert regressions(report, baseline, 0.1) == []
+
+
+def test_compare(tmp_path):
+    baseline = dict(REPORT, max_rss=2**50)  # actual RSS of this process is reported
+    (tmp_path / "baseline.json").write_text(json.dumps(baseline))
+    tester = LoadTester(MagicMock(max_clients=10))
+    tester.results = [
+        {"url": "/ok", "code": 200, "latency": 0.5, "bytes": 100},
+        {"url": "/ko", "code": 500, "latency": 0.1, "bytes": 0},
+    ]
+    with pytest.raises(AssertionError) as error:
+        tester.compare(tmp_path / "baseline.json", 0.1)
+    assert str(error.value).splitlines() == [
+        "Failed url: /ko",
+        "Regression in latency_p95: 0.2 -> 0.5",
+        "Regression in latency_p99: 0.3 -> 0.5",
+    ]
+
+
+def test_concurrency_above_max_clients():
+    with pytest.raises(ValueError, match="allows 10 requests at once, not 20"):
+        LoadTester(MagicMock(max_clients=10), concurrency=20)
@@ -0,0 +1,21 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of thumbor-wand-engine
+# https://github.com/scorphus/thumbor-wand-engine
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2020-2022, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+from thumbor.app import ThumborServiceApp
+from thumbor_wand_engine.app import App
+from unittest.mock import MagicMock
+
+
+def test_app_warms_engine_up(mocker):
+    super_init = mocker.patch.object(ThumborServiceApp, "__init__", return_value=None)
+    context = MagicMock()
+    App(context)
+    context.modules.engine.warm_up.assert_called_once_with()
+    super_init.assert_called_once_with(context)
@@ -8,19 +8,38 @@
 # http://www.opensource.org/licenses/mit-license
 # Copyright (c) 2020-2022, Pablo S. Blum de Aguiar <scorphus@gmail.com>
 
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
+from json import dumps
 from os.path import abspath
 from os.path import dirname
 from os.path import join
+from threading import current_thread
 from thumbor.config import Config
 from thumbor.context import Context
 from thumbor.engines.pil import Engine as PileEngine
+from thumbor_wand_engine.engine import compose
 from thumbor_wand_engine.engine import Engine
+from thumbor_wand_engine.engine import FLIP_HORIZONTAL
+from thumbor_wand_engine.engine import FLIP_VERTICAL
+from thumbor_wand_engine.engine import IDENTITY
+from thumbor_wand_engine.engine import load_icc_profile
+from thumbor_wand_engine.engine import orientation_exif
+from thumbor_wand_engine.engine import ROTATE_90
+from thumbor_wand_engine.engine import ROTATE_180
+from thumbor_wand_engine.engine import ROTATE_270
+from thumbor_wand_engine.engine import summarize_trace
+from thumbor_wand_engine.engine import TRANSPOSE
+from thumbor_wand_engine.engine import TRANSVERSE
+from tornado.ioloop import IOLoop
 from unittest.mock import MagicMock
 from wand.color import Color
+from wand.exceptions import WandException
 from wand.image import IMAGE_TYPES
 from wand.image import ORIENTATION_TYPES
 
+import asyncio
+import piexif
 import pytest
 
 
@@ -319,6 +338,56 @@ def test_can_read_as_format_quality(image_format, quality, engine):
     assert img.format == image_format
 
 
+@pytest.mark.parametrize("image_format", ["PNG", "WEBP", "JPEG"])
+def test_can_read_into_temporary_file(image_format, transp_engine):
+    with transp_engine.read_into(extension=f".{image_format.lower()}") as file:
+        img = transp_engine.create_image(file.read())
+    assert img.format == image_format
+    assert img.size == transp_engine.size
+
+
+def test_can_read_into_file(transp_engine, tmp_path):
+    with open(tmp_path / "image.webp", "wb") as file:
+        assert transp_engine.read_into(file, ".webp", 50) is file
+    img = transp_engine.create_image((tmp_path / "image.webp").read_bytes())
+    assert transp_engine.image.compression_quality == 50
+    assert img.format == "WEBP"
+
+
+def test_can_read_into_file_by_name(transp_engine, tmp_path, mocker):
+    save = mocker.spy(transp_engine.image, "save")
+    with open(tmp_path / "image.png", "wb") as file:
+        transp_engine.read_into(file, ".jpg")
+        position = file.tell()
+    save.assert_called_once_with(filename=f"JPEG:{tmp_path / 'image.png'}")
+    assert position == (tmp_path / "image.png").stat().st_size
+    img = transp_engine.create_image((tmp_path / "image.png").read_bytes())
+    assert img.format == "JPEG"
+
+
+@pytest.mark.parametrize("mode", ["wb", "ab"])
+def test_can_read_into_file_after_its_content(mode, transp_engine, tmp_path, mocker):
+    save = mocker.spy(transp_engine.image, "save")
+    with open(tmp_path / "image.png", mode) as file:
+        file.write(b"prefix")
+        transp_engine.read_into(file, ".png")
+        position = file.tell()
+    save.assert_not_called()
+    content = (tmp_path / "image.png").read_bytes()
+    assert position == len(content)
+    assert content.startswith(b"prefix")
+    img = transp_engine.create_image(content.replace(b"prefix", b"", 1))
+    assert img.format == "PNG"
+
+
+def test_can_read_into_file_like_object(transp_engine):
+    file = BytesIO()
+    transp_engine.read_into(file, ".png")
+    img = transp_engine.create_image(file.getvalue())
+    assert img.format == "PNG"
+    assert img.size == transp_engine.size
+
+
 @pytest.mark.parametrize(
     "image, filters, expected_output",
     [
@@ -370,6 +439,122 @@ def test_strip_exif(green_engine, green_image):
     green_image.profiles.__delitem__.assert_any_call("xmp")
 
 
+@pytest.mark.parametrize(
+    "policy, expected_skipped_profiles",
+    [
+        ("strip", "8bim,icc,iptc,xmp"),
+        ("orientation_icc", "8bim,iptc,xmp"),
+    ],
+)
+def test_create_image_skips_profiles(policy, expected_skipped_profiles, engine):
+    engine.context.config.WAND_METADATA_POLICY = policy
+    with open(join(STORAGE_PATH, "image.jpg"), "rb") as image_file:
+        buffer = image_file.read()
+    engine.load(buffer, None)
+    assert engine.image.options["profile:skip"] == expected_skipped_profiles
+    assert engine.image.format == "JPEG"
+    assert engine.image.size == (300, 400)
+
+
+def test_create_image_keeps_icc_profile_to_convert_to_srgb(engine, tmp_path):
+    (tmp_path / "sRGB.icc").write_bytes(b"sRGB")
+    engine.context.config.WAND_METADATA_POLICY = "strip"
+    engine.context.config.WAND_SRGB_ICC_PROFILE = str(tmp_path / "sRGB.icc")
+    with open(join(STORAGE_PATH, "image.jpg"), "rb") as image_file:
+        buffer = image_file.read()
+    engine.load(buffer, None)
+    assert engine.image.options["profile:skip"] == "8bim,iptc,xmp"
+
+
+def test_invalid_metadata_policy(engine):
+    engine.context.config.WAND_METADATA_POLICY = "orientation"
+    with pytest.raises(ValueError, match="invalid WAND_METADATA_POLICY 'orientation'"):
+        engine.create_image(b"buffer")
+    with pytest.raises(ValueError, match="expected one of: keep, strip, orientation"):
+        engine.warm_up()
+
+
+def test_create_image_keeps_profiles(engine):
+    with open(join(STORAGE_PATH, "image.jpg"), "rb") as image_file:
+        buffer = image_file.read()
+    engine.load(buffer, None)
+    assert "profile:skip" not in engine.image.options
+
+
+@pytest.mark.parametrize(
+    "icc_profile, expected_call_count", [(None, 0), (b"sRGB", 0), (b"Adobe", 1)]
+)
+def test_create_image_converts_to_srgb(
+    icc_profile, expected_call_count, engine, mocker, tmp_path
+):
+    (tmp_path / "sRGB.icc").write_bytes(b"sRGB")
+    engine.context.config.WAND_SRGB_ICC_PROFILE = str(tmp_path / "sRGB.icc")
+    image = MagicMock(profiles={"icc": icc_profile})
+    mocker.patch("thumbor_wand_engine.engine.Image", return_value=image)
+    library = mocker.patch("thumbor_wand_engine.engine.library")
+    assert engine.create_image(b"buffer") is image
+    assert library.MagickProfileImage.call_count == expected_call_count
+    if expected_call_count:
+        library.MagickProfileImage.assert_called_once_with(
+            image.wand, b"icc", b"sRGB", 4
+        )
+
+
+def test_load_icc_profile_is_cached(tmp_path):
+    (tmp_path / "sRGB.icc").write_bytes(b"sRGB")
+    profile = load_icc_profile(str(tmp_path / "sRGB.icc"))
+    (tmp_path / "sRGB.icc").unlink()
+    assert load_icc_profile(str(tmp_path / "sRGB.icc")) is profile
+
+
+def test_read_keeps_metadata(green_engine, green_image):
+    green_engine.read(".png")
+    green_image.strip.assert_not_called()
+    green_image.profiles.__delitem__.assert_not_called()
+
+
+def test_read_strips_metadata(green_engine, green_image):
+    green_engine.context.config.WAND_METADATA_POLICY = "strip"
+    green_engine.read(".png")
+    green_image.strip.assert_called_once_with()
+
+
+@pytest.mark.parametrize(
+    "orientation, expected_deleted_profiles",
+    [
+        ("undefined", ["8bim", "iptc", "xmp", "exif"]),
+        ("top_left", ["8bim", "iptc", "xmp", "exif"]),
+        ("right_top", ["8bim", "iptc", "xmp"]),
+    ],
+)
+def test_read_keeps_only_orientation_and_icc(
+    orientation, expected_deleted_profiles, green_engine, green_image
+):
+    green_engine.context.config.WAND_METADATA_POLICY = "orientation_icc"
+    green_image.orientation = orientation
+    green_engine.read(".png")
+    deleted_profiles = [
+        args[0] for args, _ in green_image.profiles.__delitem__.call_args_list
+    ]
+    assert deleted_profiles == expected_deleted_profiles
+
+
+def test_read_replaces_exif_with_orientation_only(green_engine, green_image):
+    green_engine.context.config.WAND_METADATA_POLICY = "orientation_icc"
+    green_image.orientation = "right_top"
+    green_engine.read(".jpg")
+    green_image.profiles.__setitem__.assert_called_once_with(
+        "exif", orientation_exif(6)
+    )
+
+
+def test_orientation_exif():
+    exif = piexif.load(orientation_exif(6))
+    assert exif["0th"] == {piexif.ImageIFD.Orientation: 6}
+    assert exif["Exif"] == exif["GPS"] == exif["1st"] == {}
+    assert exif["thumbnail"] is None
+
+
 def test_flip_vertically(green_engine, green_image):
     green_engine.flip_vertically()
     green_image.flip.assert_called_once_with()
@@ -396,6 +581,12 @@ def test_rotate(degrees, green_engine, green_image):
     green_image.rotate.assert_called_once_with(degrees)
 
 
+@pytest.mark.parametrize("degrees", [0, 360, -720])
+def test_rotate_skips_whole_turns(degrees, green_engine, green_image):
+    green_engine.rotate(degrees)
+    green_image.rotate.assert_not_called()
+
+
 @pytest.mark.parametrize(
     "pos, merge, expected_operator",
     [
@@ -456,3 +647,335 @@ def test_has_transparency(green_engine, opaque_engine, transp_engine):
     assert green_engine.has_transparency() is False
     assert opaque_engine.has_transparency() is False
     assert transp_engine.has_transparency() is True
+
+
+def test_warm_up(engine):
+    engine.context.config.WAND_WARM_UP_FORMATS = ["jpeg", "png", "webp"]
+    timings = engine.warm_up()
+    assert set(timings) == {"JPEG", "PNG", "WEBP"}
+    assert all(secs >= 0 for secs in timings.values())
+
+
+@pytest.mark.parametrize(
+    "lossless_jpeg, jpegtran_path, expected_warning",
+    [(False, None, False), (True, __file__, False), (True, None, True)],
+)
+def test_warm_up_checks_jpegtran_path(
+    lossless_jpeg, jpegtran_path, expected_warning, engine, mocker
+):
+    logger = mocker.patch("thumbor_wand_engine.engine.logger")
+    engine.context.config.WAND_WARM_UP_FORMATS = []
+    engine.context.config.WAND_LOSSLESS_JPEG_TRANSFORMS = lossless_jpeg
+    engine.context.config.JPEGTRAN_PATH = jpegtran_path
+    engine.warm_up()
+    assert logger.warning.called is expected_warning
+
+
+def test_warm_up_skips_unsupported_format(engine):
+    engine.context.config.WAND_WARM_UP_FORMATS = ["png", "not-a-format"]
+    assert set(engine.warm_up()) == {"PNG"}
+
+
+def test_warm_up_skips_failing_format(engine, mocker):
+    engine.context.config.WAND_WARM_UP_FORMATS = ["png"]
+    mocker.patch.object(engine, "create_image", side_effect=WandException)
+    assert engine.warm_up() == {}
+
+
+@pytest.mark.parametrize(
+    "wand_trace, request_debug, expected_tracing",
+    [
+        (False, None, False),
+        (False, False, False),
+        (False, True, True),
+        (True, None, True),
+        (True, False, True),
+    ],
+)
+def test_is_tracing(wand_trace, request_debug, expected_tracing, engine):
+    engine.context.config.WAND_TRACE = wand_trace
+    if request_debug is not None:
+        engine.context.request = MagicMock(debug=request_debug)
+    assert engine.is_tracing() is expected_tracing
+
+
+def test_traced_operation_not_tracing(green_engine):
+    green_engine.resize(2, 2)
+    assert green_engine.trace == []
+
+
+def test_traced_operation(green_engine):
+    buffer = green_engine.image.make_blob("png")
+    green_engine.context.config.WAND_TRACE = True
+    green_engine.image = None
+    green_engine.image = green_engine.create_image(buffer)
+    green_engine.resize(2, 2)
+    green_engine.rotate(90)
+    operations = [entry["operation"] for entry in green_engine.trace]
+    assert operations == ["create_image", "resize", "rotate"]
+    entry = green_engine.trace[0]
+    assert entry["cache"] == "memory"
+    assert entry["size"] == (1, 1)
+    entry = green_engine.trace[1]
+    assert entry["ms"] >= 0
+    assert entry["cache"] == "memory"
+    assert entry["size"] == (2, 2)
+    assert all(entry[resource] >= 0 for resource in ("memory", "map", "disk"))
+
+
+@pytest.mark.parametrize("read", ["read", "read_into"])
+def test_read_logs_trace(read, green_engine, mocker):
+    logger = mocker.patch("thumbor_wand_engine.engine.logger")
+    green_engine.context.config.WAND_TRACE = True
+    green_engine.flip_horizontally()
+    getattr(green_engine, read)(extension=".png")
+    assert green_engine.trace == []
+    trace = logger.info.call_args.kwargs["extra"]["wand_trace"]
+    assert [entry["operation"] for entry in trace] == ["flip_horizontally", read]
+    logger.info.assert_called_once_with(
+        "[wand] trace of %s: %s", None, dumps(trace), extra={"wand_trace": trace}
+    )
+
+
+def test_read_does_not_log_when_not_tracing(green_engine, mocker):
+    logger = mocker.patch("thumbor_wand_engine.engine.logger")
+    green_engine.flip_horizontally()
+    green_engine.read(".png")
+    logger.info.assert_not_called()
+
+
+def test_read_sets_trace_header_on_debug_requests(green_engine, mocker):
+    logger = mocker.patch("thumbor_wand_engine.engine.logger")
+    green_engine.context.request = MagicMock(debug=True, url="/debug/unsafe/x.png")
+    green_engine.context.request_handler = MagicMock()
+    green_engine.flip_vertically()
+    green_engine.read(".png")
+    trace = logger.info.call_args.kwargs["extra"]["wand_trace"]
+    green_engine.context.request_handler.set_header.assert_called_once_with(
+        "X-Wand-Trace", dumps(summarize_trace(trace))
+    )
+
+
+def test_read_sets_trace_header_from_thread_pool(mocker):
+    mocker.patch("thumbor_wand_engine.engine.logger")
+    threads = []
+    request_handler = MagicMock()
+    request_handler.set_header.side_effect = lambda *_: threads.append(current_thread())
+
+    async def read_in_thread_pool():
+        engine = Engine(get_context())
+        engine.context.request = MagicMock(debug=True)
+        engine.context.request_handler = request_handler
+        engine.image = engine.gen_image((1, 1), "green")
+        engine.flip_vertically()
+        with ThreadPoolExecutor(1) as pool:
+            await IOLoop.current().run_in_executor(pool, engine.read, ".png")
+
+    asyncio.run(read_in_thread_pool())
+    assert request_handler.set_header.call_args[0][0] == "X-Wand-Trace"
+    assert threads == [current_thread()]
+
+
+def test_read_does_not_set_trace_header_when_tracing_globally(green_engine, mocker):
+    mocker.patch("thumbor_wand_engine.engine.logger")
+    green_engine.context.config.WAND_TRACE = True
+    green_engine.context.request = MagicMock(debug=False)
+    green_engine.context.request_handler = MagicMock()
+    green_engine.flip_vertically()
+    green_engine.read(".png")
+    green_engine.context.request_handler.set_header.assert_not_called()
+
+
+def test_summarize_trace():
+    trace = [
+        {"operation": operation, "ms": ms, "cache": cache, **resources}
+        for operation, ms, cache, resources in (
+            ("resize", 1.5, "memory", {"memory": 4, "map": 0, "disk": 0}),
+            ("resize", 2.25, "disk", {"memory": 8, "map": 1, "disk": 2}),
+            ("read", 3, "disk", {"memory": 2, "map": 0, "disk": 5}),
+        )
+    ]
+    assert summarize_trace(trace) == {
+        "ms": {"resize": 3.75, "read": 3},
+        "cache": ["disk", "memory"],
+        "memory": 8,
+        "map": 1,
+        "disk": 5,
+    }
+
+
+@pytest.mark.parametrize(
+    "transform, other, expected_transform",
+    [
+        (ROTATE_90, ROTATE_90, ROTATE_180),
+        (ROTATE_90, ROTATE_270, IDENTITY),
+        (ROTATE_180, ROTATE_90, ROTATE_270),
+        (FLIP_HORIZONTAL, FLIP_HORIZONTAL, IDENTITY),
+        (FLIP_HORIZONTAL, FLIP_VERTICAL, ROTATE_180),
+        (FLIP_VERTICAL, ROTATE_90, TRANSPOSE),
+        (FLIP_HORIZONTAL, ROTATE_90, TRANSVERSE),
+    ],
+)
+def test_compose(transform, other, expected_transform):
+    assert compose(transform, other) == expected_transform
+
+
+@pytest.fixture
+def jpeg_engine(mocker):
+    with open(join(STORAGE_PATH, "image.jpg"), "rb") as image_file:
+        buffer = image_file.read()
+    engine = Engine(get_context())
+    engine.context.config.WAND_LOSSLESS_JPEG_TRANSFORMS = True
+    engine.context.config.JPEGTRAN_PATH = __file__  # just needs to exist
+    engine.load(buffer, ".jpg")
+    return engine
+
+
+@pytest.fixture
+def jpegtran(mocker, jpeg_engine):
+    return mocker.patch(
+        "thumbor_wand_engine.engine.run",
+        return_value=MagicMock(returncode=0, stdout=b"losslessly transformed"),
+    )
+
+
+def test_read_losslessly_as_is(jpeg_engine, jpegtran):
+    assert jpeg_engine.read(".jpg") == jpeg_engine.jpeg_buffer
+    jpegtran.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    "operations, expected_transform",
+    [
+        ([("rotate", 90)], ["-rotate", "90"]),
+        ([("rotate", -90)], ["-rotate", "270"]),
+        ([("rotate", 90), ("rotate", 90)], ["-rotate", "180"]),
+        ([("flip_horizontally",)], ["-flip", "horizontal"]),
+        ([("flip_vertically",)], ["-flip", "vertical"]),
+        ([("flip_vertically",), ("rotate", 90)], ["-transpose"]),
+        ([("flip_horizontally",), ("rotate", 90)], ["-transverse"]),
+    ],
+)
+def test_read_losslessly(operations, expected_transform, jpeg_engine, jpegtran):
+    for name, *args in operations:
+        getattr(jpeg_engine, name)(*args)
+    assert jpeg_engine.read(".jpg", 100) == b"losslessly transformed"
+    jpegtran.assert_called_once_with(
+        [__file__, "-copy", "all", "-perfect"] + expected_transform,
+        input=jpeg_engine.jpeg_buffer,
+        capture_output=True,
+    )
+
+
+@pytest.mark.parametrize(
+    "policy, expected_copy", [("strip", "none"), ("orientation_icc", "icc")]
+)
+def test_read_losslessly_metadata_policy(policy, expected_copy, jpeg_engine, jpegtran):
+    jpeg_engine.context.config.WAND_METADATA_POLICY = policy
+    assert jpeg_engine.read(".jpg") == b"losslessly transformed"
+    assert jpegtran.call_args[0][0] == [__file__, "-copy", expected_copy, "-perfect"]
+
+
+def test_read_losslessly_keeps_orientation_of_not_reorientated(jpeg_engine, jpegtran):
+    jpeg_engine.context.config.WAND_METADATA_POLICY = "orientation_icc"
+    jpegtran.return_value.stdout = jpeg_engine.jpeg_buffer
+    jpeg_engine.image.orientation = "right_top"
+    jpeg_engine.rotate(180)
+    buffer = jpeg_engine.read(".jpg", 80)
+    assert jpegtran.call_args[0][0][1:3] == ["-copy", "icc"]
+    assert piexif.load(buffer)["0th"] == {piexif.ImageIFD.Orientation: 6}
+    assert jpeg_engine.create_image(buffer).orientation == "right_top"
+
+
+def test_read_losslessly_reorientated(jpeg_engine, jpegtran):
+    jpegtran.return_value.stdout = jpeg_engine.jpeg_buffer
+    jpeg_engine.image.orientation = "right_top"
+    jpeg_engine.reorientate()
+    assert jpeg_engine.image.size == (400, 300)
+    img = jpeg_engine.create_image(jpeg_engine.read_into(extension=".jpg").read())
+    assert img.size == (300, 400)  # as returned by the mocked jpegtran
+    assert img.orientation in ("undefined", "top_left")
+    assert jpegtran.call_args[0][0][-2:] == ["-rotate", "90"]
+
+
+@pytest.mark.parametrize(
+    "operation",
+    [
+        lambda engine: engine.resize(10, 10),
+        lambda engine: engine.crop(0, 0, 10, 10),
+        lambda engine: engine.rotate(45),
+        lambda engine: engine.convert_to_grayscale(),
+        lambda engine: engine.enable_alpha(),
+        lambda engine: engine.strip_icc(),
+        lambda engine: engine.strip_exif(),
+        lambda engine: setattr(engine, "image", engine.image.clone()),
+    ],
+)
+def test_read_not_losslessly_after_other_changes(operation, jpeg_engine, jpegtran):
+    operation(jpeg_engine)
+    buffer = jpeg_engine.read(".jpg")
+    jpegtran.assert_not_called()
+    assert jpeg_engine.create_image(buffer).format == "JPEG"
+
+
+@pytest.mark.parametrize("honor_quality", [False, True])
+def test_read_losslessly_with_lower_quality(honor_quality, jpeg_engine, jpegtran):
+    jpeg_engine.context.config.WAND_LOSSLESS_JPEG_HONOR_QUALITY = honor_quality
+    jpeg_engine.rotate(90)
+    jpeg_engine.read(".jpg", jpeg_engine.jpeg_quality)
+    jpegtran.assert_called_once()
+    jpeg_engine.read(".jpg", 1)
+    assert jpegtran.call_count == (1 if honor_quality else 2)
+
+
+@pytest.mark.parametrize("request_quality", [1, 100])
+def test_read_losslessly_honors_quality_filter(request_quality, jpeg_engine, jpegtran):
+    jpeg_engine.context.request = MagicMock(quality=request_quality, max_bytes=None)
+    jpeg_engine.rotate(90)
+    jpeg_engine.read(".jpg", request_quality)
+    assert jpegtran.called is (request_quality >= jpeg_engine.jpeg_quality)
+
+
+def test_read_not_losslessly_with_max_bytes(jpeg_engine, jpegtran):
+    jpeg_engine.context.request = MagicMock(quality=None, max_bytes=1000)
+    jpeg_engine.rotate(90)
+    buffer = jpeg_engine.read(".jpg", 80)
+    assert jpeg_engine.read(".jpg", 20) != buffer
+    jpegtran.assert_not_called()
+
+
+@pytest.mark.parametrize("extension, quality", [(".png", None), (".jpg", 1)])
+def test_read_not_losslessly_as_other_format_or_lower_quality(
+    extension, quality, jpeg_engine, jpegtran
+):
+    jpeg_engine.context.config.WAND_LOSSLESS_JPEG_HONOR_QUALITY = True
+    jpeg_engine.rotate(90)
+    jpeg_engine.read(extension, quality)
+    jpegtran.assert_not_called()
+
+
+def test_read_not_losslessly_when_jpegtran_fails(jpeg_engine, jpegtran, mocker):
+    logger = mocker.patch("thumbor_wand_engine.engine.logger")
+    jpegtran.return_value.returncode = 1
+    jpeg_engine.rotate(90)
+    buffer = jpeg_engine.read(".jpg")
+    assert jpeg_engine.create_image(buffer).size == (400, 300)
+    logger.warning.assert_not_called()
+
+
+def test_read_not_losslessly_without_jpegtran(jpeg_engine, jpegtran, mocker):
+    logger = mocker.patch("thumbor_wand_engine.engine.logger")
+    jpeg_engine.context.config.JPEGTRAN_PATH = None
+    jpeg_engine.rotate(90)
+    buffer = jpeg_engine.read(".jpg")
+    assert jpeg_engine.create_image(buffer).size == (400, 300)
+    jpegtran.assert_not_called()
+    logger.warning.assert_not_called()
+
+
+def test_read_not_losslessly_when_disabled(engine, jpegtran):
+    with open(join(STORAGE_PATH, "image.jpg"), "rb") as image_file:
+        engine.load(image_file.read(), ".jpg")
+    engine.rotate(90)
+    engine.read(".jpg")
+    jpegtran.assert_not_called()
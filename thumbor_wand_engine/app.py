@@ -0,0 +1,21 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of thumbor-wand-engine
+# https://github.com/scorphus/thumbor-wand-engine
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2020-2022, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+from thumbor.app import ThumborServiceApp
+
+
+class App(ThumborServiceApp):
+    """App warms the engine up before thumbor binds its socket (and forks its
+    processes, if any), so workers reach steady-state latency before they take
+    any traffic"""
+
+    def __init__(self, context):
+        context.modules.engine.warm_up()
+        super().__init__(context)
@@ -8,12 +8,38 @@
 # http://www.opensource.org/licenses/mit-license
 # Copyright (c) 2020-2022, Pablo S. Blum de Aguiar <scorphus@gmail.com>
 
+from ctypes import c_bool
+from ctypes import c_char_p
+from ctypes import c_int
+from ctypes import c_size_t
+from ctypes import c_void_p
+from functools import lru_cache
+from functools import wraps
+from io import BytesIO
+from os import SEEK_END
+from os.path import exists
+from subprocess import run
+from tempfile import NamedTemporaryFile
+from thumbor.config import Config
 from thumbor.engines import BaseEngine
+from thumbor.engines.extensions.exif_orientation_editor import ExifOrientationEditor
 from thumbor.utils import deprecated
+from thumbor.utils import logger
+from time import perf_counter
+from tornado.ioloop import IOLoop
+from wand.api import library
 from wand.drawing import Drawing
+from wand.exceptions import WandException
 from wand.image import Image
 from wand.image import IMAGE_TYPES
 from wand.image import ORIENTATION_TYPES
+from wand.resource import limits
+from wand.version import configure_options
+from wand.version import formats
+
+import asyncio
+import json
+import piexif
 
 
 GRAYSCALE_TYPE = IMAGE_TYPES[2]
@@ -21,12 +47,314 @@ GRAYSCALEALPHA_TYPE = IMAGE_TYPES[3]
 TRUECOLORALPHA_TYPE = IMAGE_TYPES[7]
 
 
+Config.define(
+    "WAND_WARM_UP_FORMATS",
+    ["jpeg", "png", "gif", "webp"],
+    "Formats whose ImageMagick coders are loaded by `Engine.warm_up`",
+    "Wand Engine",
+)
+Config.define(
+    "WAND_METADATA_POLICY",
+    "keep",
+    "Metadata to keep in images: `keep` all of it, `strip` all of it, or keep only "
+    "the orientation and the ICC profile with `orientation_icc`",
+    "Wand Engine",
+)
+Config.define(
+    "WAND_SRGB_ICC_PROFILE",
+    None,
+    "Path to an sRGB ICC profile to convert images with other ICC profiles to",
+    "Wand Engine",
+)
+Config.define(
+    "WAND_TRACE",
+    False,
+    "Log a trace of the ImageMagick operations of every request (timing, pixel cache "
+    "type and resource usage); requests to `/debug` URLs are always traced, and get "
+    "a summary of it in the `X-Wand-Trace` header",
+    "Wand Engine",
+)
+Config.define(
+    "WAND_LOSSLESS_JPEG_TRANSFORMS",
+    False,
+    "Rotate, flip and reorientate JPEG images output as JPEG with no other change "
+    "losslessly with jpegtran (JPEGTRAN_PATH) instead of re-encoding them, keeping "
+    "the quality of the source image",
+    "Wand Engine",
+)
+Config.define(
+    "WAND_LOSSLESS_JPEG_HONOR_QUALITY",
+    False,
+    "Re-encode instead of transforming losslessly when the requested quality is "
+    "lower than that of the source image, even if it is just the QUALITY default; "
+    "the `quality` and `max_bytes` filters are always honored",
+    "Wand Engine",
+)
+
+# EXIF is never skipped at decode time for ImageMagick reads orientation from it
+PROFILES_SKIPPED_AT_DECODE = {
+    "keep": (),
+    "strip": ("8bim", "icc", "iptc", "xmp"),
+    "orientation_icc": ("8bim", "iptc", "xmp"),
+}
+
+library.MagickProfileImage.argtypes = [c_void_p, c_char_p, c_void_p, c_size_t]
+library.MagickProfileImage.restype = c_bool
+library.GetImagePixelCacheType.argtypes = [c_void_p]
+library.GetImagePixelCacheType.restype = c_int
+
+# Orthogonal transformations as matrices on (x, y) coordinates, with y pointing down
+IDENTITY = ((1, 0), (0, 1))
+FLIP_HORIZONTAL = ((-1, 0), (0, 1))
+FLIP_VERTICAL = ((1, 0), (0, -1))
+ROTATE_90 = ((0, -1), (1, 0))  # clockwise, as ImageMagick and jpegtran rotate
+ROTATE_180 = ((-1, 0), (0, -1))
+ROTATE_270 = ((0, 1), (-1, 0))
+TRANSPOSE = ((0, 1), (1, 0))
+TRANSVERSE = ((0, -1), (-1, 0))
+
+ROTATIONS = {0: IDENTITY, 90: ROTATE_90, 180: ROTATE_180, 270: ROTATE_270}
+ORIENTATION_TRANSFORMS = {
+    "undefined": IDENTITY,
+    "top_left": IDENTITY,
+    "top_right": FLIP_HORIZONTAL,
+    "bottom_right": ROTATE_180,
+    "bottom_left": FLIP_VERTICAL,
+    "left_top": TRANSPOSE,
+    "right_top": ROTATE_90,
+    "right_bottom": TRANSVERSE,
+    "left_bottom": ROTATE_270,
+}
+JPEGTRAN_TRANSFORMS = {
+    IDENTITY: [],
+    FLIP_HORIZONTAL: ["-flip", "horizontal"],
+    FLIP_VERTICAL: ["-flip", "vertical"],
+    ROTATE_90: ["-rotate", "90"],
+    ROTATE_180: ["-rotate", "180"],
+    ROTATE_270: ["-rotate", "270"],
+    TRANSPOSE: ["-transpose"],
+    TRANSVERSE: ["-transverse"],
+}
+JPEGTRAN_COPY = {"keep": "all", "strip": "none", "orientation_icc": "icc"}
+
+CACHE_TYPES = ("undefined", "disk", "distributed", "map", "memory", "ping")
+TRACED_RESOURCES = ("memory", "map", "disk")
+
+
+@lru_cache()
+def load_icc_profile(path):
+    with open(path, "rb") as profile_file:
+        return profile_file.read()
+
+
+@lru_cache()
+def jpegtran_exists(path):
+    return path is not None and exists(path)
+
+
+def orientation_exif(orientation):
+    """orientation_exif is an EXIF profile holding nothing but the orientation"""
+    return piexif.dump({"0th": {piexif.ImageIFD.Orientation: orientation}})
+
+
+def running_io_loop():
+    """running_io_loop is the IOLoop running in this thread, if any"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+    return IOLoop.current()
+
+
+def writable_by_name(file):
+    """writable_by_name tells whether ImageMagick can write `file` by its name
+    as a Python write would: it truncates the file, ignoring its position and
+    mode, and reads `[...]` and `%d` in names as image options and scenes"""
+    name = getattr(file, "name", None)
+    return (
+        isinstance(name, str)
+        and not any(char in name for char in "[%")
+        and "a" not in getattr(file, "mode", "")
+        and file.tell() == 0
+    )
+
+
+def compose(transform, other):
+    """compose returns the transformation of applying `transform`, then `other`"""
+    return tuple(
+        tuple(sum(other[i][k] * transform[k][j] for k in range(2)) for j in range(2))
+        for i in range(2)
+    )
+
+
+def changes_pixels(method):
+    """changes_pixels rules out outputting a JPEG losslessly after `method`"""
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        self.jpeg_buffer = None
+        return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+def traced(method):
+    """traced records how long `method` takes, along with the pixel cache type
+    (of the image it returns, if any) and ImageMagick's resource usage after it,
+    when the engine is tracing"""
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if not self.is_tracing():
+            return method(self, *args, **kwargs)
+        start = perf_counter()
+        result = None
+        try:
+            result = method(self, *args, **kwargs)
+            return result
+        finally:
+            self.add_trace(method.__name__, perf_counter() - start, result)
+
+    return wrapper
+
+
+def logs_trace(method):
+    """logs_trace logs the trace once `method`, which outputs the image, is done"""
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.log_trace()
+
+    return wrapper
+
+
+def summarize_trace(trace):
+    """summarize_trace adds up the time of each operation and keeps the cache types
+    seen and the peak resource usage, so its size depends on the operations used,
+    not on how many times they were"""
+    summary = {
+        "ms": {},
+        "cache": sorted({entry["cache"] for entry in trace if "cache" in entry}),
+    }
+    for entry in trace:
+        operation = entry["operation"]
+        summary["ms"][operation] = round(
+            summary["ms"].get(operation, 0) + entry["ms"], 3
+        )
+    for resource in TRACED_RESOURCES:
+        summary[resource] = max(entry[resource] for entry in trace)
+    return summary
+
+
 class Engine(BaseEngine):
+    def __init__(self, context):
+        super().__init__(context)
+        self.trace = []
+        self.jpeg_buffer = None
+        self.io_loop = running_io_loop()  # that of the request handler
+
+    def is_tracing(self):
+        request = getattr(self.context, "request", None)
+        return bool(self.context.config.WAND_TRACE or (request and request.debug))
+
+    def add_trace(self, operation, elapsed, result=None):
+        entry = {"operation": operation, "ms": round(elapsed * 1000, 3)}
+        # create_image returns the image it decodes before self.image is set
+        image = result if isinstance(result, Image) else self.image
+        if isinstance(image, Image):
+            image_p = library.GetImageFromMagickWand(image.wand)
+            entry["cache"] = CACHE_TYPES[library.GetImagePixelCacheType(image_p)]
+            entry["size"] = image.size
+        for resource in TRACED_RESOURCES:
+            entry[resource] = limits.resource(resource)
+        self.trace.append(entry)
+
+    def log_trace(self):
+        if not self.trace:
+            return
+        request = getattr(self.context, "request", None)
+        logger.info(
+            "[wand] trace of %s: %s",
+            getattr(request, "url", None),
+            json.dumps(self.trace),
+            extra={"wand_trace": self.trace},
+        )
+        request_handler = getattr(self.context, "request_handler", None)
+        if getattr(request, "debug", False) and request_handler is not None:
+            summary = json.dumps(summarize_trace(self.trace))
+            if self.io_loop is None or running_io_loop() is self.io_loop:
+                request_handler.set_header("X-Wand-Trace", summary)
+            else:
+                # read in thumbor's thread pool, and handlers are not thread-safe;
+                # this runs before the handler gets the result of the read
+                self.io_loop.add_callback(
+                    request_handler.set_header, "X-Wand-Trace", summary
+                )
+        self.trace = []
+
     def gen_image(self, size, color):
         return Image().blank(*size, color)
 
+    def load(self, buffer, extension):
+        super().load(buffer, extension)
+        self.jpeg_buffer = None
+        config = self.context.config
+        lossless_jpeg = config.WAND_LOSSLESS_JPEG_TRANSFORMS
+        if config.WAND_SRGB_ICC_PROFILE:  # colors may have been converted
+            lossless_jpeg = False
+        if lossless_jpeg and self.image.format == "JPEG":
+            self.jpeg_buffer = buffer
+            self.jpeg_image = self.image
+            self.jpeg_quality = self.image.compression_quality
+            self.jpeg_transform = IDENTITY
+            self.jpeg_reoriented = False
+
+    def add_jpeg_transform(self, transform):
+        if transform is None:
+            self.jpeg_buffer = None
+        elif self.jpeg_buffer is not None:
+            self.jpeg_transform = compose(self.jpeg_transform, transform)
+
+    def metadata_policy(self):
+        policy = self.context.config.WAND_METADATA_POLICY
+        if policy not in PROFILES_SKIPPED_AT_DECODE:
+            raise ValueError(
+                f"invalid WAND_METADATA_POLICY {policy!r}, expected one of: "
+                + ", ".join(PROFILES_SKIPPED_AT_DECODE)
+            )
+        return policy
+
+    @traced
     def create_image(self, buffer):
-        return Image(blob=buffer)
+        config = self.context.config
+        skipped_profiles = [
+            profile
+            for profile in PROFILES_SKIPPED_AT_DECODE[self.metadata_policy()]
+            # the ICC profile is needed to convert colors, even if stripped later
+            if not (profile == "icc" and config.WAND_SRGB_ICC_PROFILE)
+        ]
+        if not skipped_profiles:
+            image = Image(blob=buffer)
+        else:
+            image = Image()
+            image.options["profile:skip"] = ",".join(skipped_profiles)
+            image.read(blob=buffer)
+            library.MagickSetFormat(image.wand, b"")  # just like Image(blob=buffer)
+        if config.WAND_SRGB_ICC_PROFILE:
+            srgb_profile = load_icc_profile(config.WAND_SRGB_ICC_PROFILE)
+            self.convert_to_icc_profile(image, srgb_profile)
+        return image
+
+    def convert_to_icc_profile(self, image, profile):
+        """convert_to_icc_profile converts the colors of an image that has an ICC
+        profile other than `profile`; images without one are left untouched"""
+        if image.profiles["icc"] in (None, profile):
+            return
+        if not library.MagickProfileImage(image.wand, b"icc", profile, len(profile)):
+            image.raise_exception()
 
     def is_multiple(self):
         """is_multiple allows a GIF to be converted to WEBP (e.g. AUTO_WEBP) but
@@ -41,21 +369,140 @@ class Engine(BaseEngine):
     def size(self):
         return self.image.size
 
+    @traced
+    @changes_pixels
     def resize(self, width, height):
         self.image.resize(int(width), int(height))
 
+    @traced
+    @changes_pixels
     def crop(self, left, top, right, bottom):
         self.image.crop(
             left=int(left), top=int(top), right=int(right), bottom=int(bottom)
         )
 
+    @traced
     def flip_vertically(self):
         self.image.flip()
+        self.add_jpeg_transform(FLIP_VERTICAL)
 
+    @traced
     def flip_horizontally(self):
         self.image.flop()
+        self.add_jpeg_transform(FLIP_HORIZONTAL)
 
+    @logs_trace
+    @traced
     def read(self, extension=None, quality=None):
+        buffer = self._read_losslessly(extension, quality)
+        if buffer is not None:
+            return buffer
+        self._prepare_output(extension, quality)
+        return self.image.make_blob()
+
+    @logs_trace
+    @traced
+    def read_into(self, file=None, extension=None, quality=None):
+        """read_into is like `read` but has ImageMagick encode the image straight
+        into `file` (or into a new temporary file, returned rewound), sparing
+        the `bytes` copy of the output. ImageMagick writes files by name when they
+        are empty and not in append mode; other file objects get the copy written
+        at their position"""
+        buffer = self._read_losslessly(extension, quality)
+        if buffer is None:
+            self._prepare_output(extension, quality)
+        if file is None:
+            file = NamedTemporaryFile()
+            self._save(file, buffer)
+            file.seek(0)
+            return file
+        self._save(file, buffer)
+        return file
+
+    def _save(self, file, buffer):
+        """_save never hands `file` itself to Wand, which would `fdopen` its
+        descriptor and leak a `FILE` (and its buffer) on every call"""
+        if buffer is not None:
+            file.write(buffer)
+        elif writable_by_name(file):
+            file.flush()
+            self.image.save(filename=f"{self.image.format}:{file.name}")
+            file.seek(0, SEEK_END)
+        else:
+            file.write(self.image.make_blob())
+
+    def _read_losslessly(self, extension, quality):
+        """_read_losslessly has jpegtran apply the orthogonal transformations a
+        JPEG image went through when it is output as JPEG with no other change,
+        sparing its re-encoding and the generation loss"""
+        if (
+            self.jpeg_buffer is None
+            or self.image is not self.jpeg_image
+            or (extension or self.extension) not in (".jpg", ".jpeg")
+            or self._lowers_quality(quality)
+        ):
+            return None
+        policy = self.metadata_policy()
+        transform = JPEGTRAN_TRANSFORMS[self.jpeg_transform]
+        if not transform and policy == "keep" and not self.jpeg_reoriented:
+            return self.jpeg_buffer
+        jpegtran_path = self.context.config.JPEGTRAN_PATH
+        if not jpegtran_exists(jpegtran_path):  # warned about at warm-up
+            logger.debug("[wand] JPEGTRAN_PATH does not exist: %s", jpegtran_path)
+            return None
+        command = [jpegtran_path, "-copy", JPEGTRAN_COPY[policy], "-perfect"]
+        jpegtran = run(command + transform, input=self.jpeg_buffer, capture_output=True)
+        if jpegtran.returncode != 0:
+            # -perfect fails for sizes that are not multiples of the iMCU size
+            logger.debug("[wand] jpegtran failed: %s", jpegtran.stderr)
+            return None
+        if self.jpeg_reoriented and policy == "keep":
+            return self._reset_exif_orientation(jpegtran.stdout)
+        orientation = self.image.orientation
+        if policy == "orientation_icc" and orientation not in ("undefined", "top_left"):
+            # -copy icc drops the EXIF the image is still to be oriented by
+            exif = orientation_exif(ORIENTATION_TYPES.index(orientation))
+            return self._insert_exif(exif, jpegtran.stdout)
+        return jpegtran.stdout
+
+    def _lowers_quality(self, quality):
+        """_lowers_quality waives the QUALITY default thumbor reads every image
+        with, but not the `quality` filter nor `max_bytes`, which has thumbor
+        read again at lower qualities until the output fits"""
+        request = getattr(self.context, "request", None)
+        if getattr(request, "max_bytes", None) is not None:
+            return True
+        if (
+            getattr(request, "quality", None) is None
+            and not self.context.config.WAND_LOSSLESS_JPEG_HONOR_QUALITY
+        ):
+            return False
+        return quality is not None and quality < self.jpeg_quality
+
+    def _reset_exif_orientation(self, buffer):
+        exif = self.image.profiles["exif"]
+        if not exif:
+            return buffer
+        try:
+            exif_editor = ExifOrientationEditor(exif)
+            exif_editor.set_orientation(1)
+            exif = exif_editor.tobytes()
+        except Exception as error:  # pylint: disable=broad-except
+            logger.warning("[wand] could not reset EXIF orientation: %s", error)
+            return None
+        return self._insert_exif(exif, buffer)
+
+    def _insert_exif(self, exif, buffer):
+        try:
+            output = BytesIO()
+            piexif.insert(exif, buffer, output)
+            return output.getvalue()
+        except Exception as error:  # pylint: disable=broad-except
+            logger.warning("[wand] could not insert EXIF: %s", error)
+            return None
+
+    def _prepare_output(self, extension, quality):
+        self._apply_metadata_policy()
         if extension is not None:
             self.extension = extension
         image_format = self.extension.lstrip(".")
@@ -63,8 +510,22 @@ class Engine(BaseEngine):
             self.image.format = image_format
         if quality is not None:
             self.image.compression_quality = quality
-        return self.image.make_blob()
 
+    def _apply_metadata_policy(self):
+        policy = self.metadata_policy()
+        if policy == "strip":
+            self.image.strip()
+        elif policy == "orientation_icc":
+            for profile in ("8bim", "iptc", "xmp"):
+                del self.image.profiles[profile]
+            orientation = self.image.orientation
+            if orientation in ("undefined", "top_left"):
+                del self.image.profiles["exif"]
+            else:
+                orientation = ORIENTATION_TYPES.index(orientation)
+                self.image.profiles["exif"] = orientation_exif(orientation)
+
+    @traced
     @deprecated("Use image_data_as_rgb instead.")
     def get_image_data(self):
         return bytes(self.image.export_pixels(channel_map=self.get_image_mode()))
@@ -76,6 +537,8 @@ class Engine(BaseEngine):
     def image_data_as_rgb(self, update_image=True):
         return self.get_image_mode(), self.get_image_data()
 
+    @traced
+    @changes_pixels
     def set_image_data(self, data):
         self.image.import_pixels(
             width=self.image.width,
@@ -84,16 +547,21 @@ class Engine(BaseEngine):
             data=data,
         )
 
+    @traced
+    @changes_pixels
     def paste(self, other_engine, pos, merge=True):
         operator = "over" if merge else "atop"
         self.image.composite(other_engine.image, pos[0], pos[1], operator)
 
+    @traced
+    @changes_pixels
     def enable_alpha(self):
         """enable_alpha is expected to not only enable the alpha channel but
         also convert the image to truecolor/rgb, regardlessly; this method
         should have a more explicit name — but that ship has sailed =/"""
         self.image.type = TRUECOLORALPHA_TYPE
 
+    @traced
     def convert_to_grayscale(self, update_image=True, alpha=True):
         image = self.image.clone()
         if alpha and self.image.alpha_channel:
@@ -102,14 +570,25 @@ class Engine(BaseEngine):
             image.type = GRAYSCALE_TYPE
         if update_image:
             self.image = image
+            self.jpeg_buffer = None
         return image
 
+    @traced
     def rotate(self, degrees):
+        """rotate skips whole turns; ImageMagick itself transposes the pixels for
+        other multiples of 90° rather than interpolating them"""
+        if degrees % 360 == 0:
+            return
         self.image.rotate(degrees)
+        self.add_jpeg_transform(ROTATIONS.get(degrees % 360))
 
+    @traced
+    @changes_pixels
     def strip_icc(self):
         del self.image.profiles["icc"]
 
+    @traced
+    @changes_pixels
     def strip_exif(self):
         del self.image.profiles["exif"]
         del self.image.profiles["iptc"]
@@ -118,9 +597,16 @@ class Engine(BaseEngine):
     def get_orientation(self):
         return ORIENTATION_TYPES.index(self.image.orientation)
 
+    @traced
     def reorientate(self, *args, **kwargs):
+        orientation = self.image.orientation
         self.image.auto_orient()
+        transform = ORIENTATION_TRANSFORMS.get(orientation)
+        self.add_jpeg_transform(transform)
+        if transform not in (None, IDENTITY) and self.jpeg_buffer is not None:
+            self.jpeg_reoriented = True
 
+    @changes_pixels
     def draw_rectangle(self, x, y, width, height):  # pragma: no cover
         """draw_rectangle is used only in `/debug` routes"""
         with Drawing() as draw:
@@ -130,8 +616,44 @@ class Engine(BaseEngine):
             draw.rectangle(x, y, width=width, height=height)
             draw(self.image)
 
+    @traced
     def has_transparency(self):
         if self.image.alpha_channel:
             minima, _ = self.image.range_channel("alpha")
             return minima < self.image.quantum_range
         return False
+
+    def warm_up(self):
+        """warm_up loads ImageMagick's configuration and coder registries, then
+        encodes and decodes a 1x1 image in each of `WAND_WARM_UP_FORMATS` so
+        the first request for a format does not pay for lazy module loading"""
+        self.metadata_policy()  # fails at startup rather than on every request
+        jpegtran_path = self.context.config.JPEGTRAN_PATH
+        lossless_jpeg = self.context.config.WAND_LOSSLESS_JPEG_TRANSFORMS
+        if lossless_jpeg and not jpegtran_exists(jpegtran_path):
+            logger.warning("[wand] JPEGTRAN_PATH does not exist: %s", jpegtran_path)
+        start = perf_counter()
+        configure_options()
+        supported_formats = set(formats())
+        timings = {}
+        for image_format in self.context.config.WAND_WARM_UP_FORMATS:
+            image_format = image_format.upper()
+            if image_format not in supported_formats:
+                logger.warning("[wand] format %s is not supported", image_format)
+                continue
+            format_start = perf_counter()
+            try:
+                with self.gen_image((1, 1), "white") as image:
+                    image.format = image_format
+                    with self.create_image(image.make_blob()) as decoded:
+                        decoded.make_blob()
+            except WandException as error:
+                logger.error("[wand] warm-up of %s failed: %s", image_format, error)
+                continue
+            timings[image_format] = perf_counter() - format_start
+        logger.info(
+            "[wand] warm-up took %.3fs (%s)",
+            perf_counter() - start,
+            ", ".join(f"{fmt}: {secs:.3f}s" for fmt, secs in timings.items()),
+        )
+        return timings